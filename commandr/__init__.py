@@ -20,16 +20,24 @@ __all__ = [
     'update_wrapper',
     'wraps',
     'MonkeyPatchFunctools',
+    'CompletionProvider',
+    'span',
     'CommandrError',
     'CommandrUsageError',
-    'CommandrDuplicateMainError']
+    'CommandrDuplicateMainError',
+    'CommandrResourceLimitError',
+    'CommandrDependencyError',
+    'LOCK_SKIPPED_EXIT_CODE']
 
 # Export the global Commandr object methods.
 from commandr import (
   Commandr,
   CommandrError,
   CommandrUsageError,
-  CommandrDuplicateMainError)
+  CommandrDuplicateMainError,
+  CommandrResourceLimitError,
+  CommandrDependencyError,
+  LOCK_SKIPPED_EXIT_CODE)
 
 _COMMANDR = Commandr()
 
@@ -41,3 +49,9 @@ Usage = _COMMANDR.Usage
 
 # Export the decorator utils.
 from functools_util import update_wrapper, wraps, MonkeyPatchFunctools
+
+# Export the Tab-completion utils.
+from completion import CompletionProvider
+
+# Export the tracing utils.
+from tracing import span
@@ -0,0 +1,119 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# Checkpoint journal used to make commands over list-valued arguments
+# resumable. Each completed chunk of the list is recorded as a line of the form
+# "<start> <end>\n" (indexes into the list, end exclusive). A line that was
+# only partially written when the process died is ignored on resume.
+#
+
+import os
+
+from fs_util import MakeDirs
+
+class CheckpointJournal(object):
+  """Append-only record of completed chunks of a list argument."""
+
+  def __init__(self, path, fsync=True):
+    """Initializes a CheckpointJournal.
+
+    Args:
+      path - Path of the journal file.
+      fsync - Policy for flushing records to disk. True to fsync after every
+          record, False to never fsync, or an int N to fsync every N records.
+    """
+    self.path = path
+    self.fsync = fsync
+    self._file = None
+    self._unsynced = 0
+
+  def Completed(self):
+    """Reads the journal and returns the set of completed item indexes."""
+    done = set()
+    if not os.path.exists(self.path):
+      return done
+
+    with open(self.path) as f:
+      for line in f:
+        if not line.endswith('\n'):
+          # Torn write from a crash; the chunk was not committed.
+          break
+        try:
+          start, end = [int(v) for v in line.split()]
+        except ValueError:
+          continue
+        done.update(xrange(start, end))
+    return done
+
+  def Open(self, resume):
+    """Opens the journal for appending.
+
+    Args:
+      resume - If False, any existing journal is discarded.
+    """
+    directory = os.path.dirname(self.path)
+    if directory:
+      MakeDirs(directory)
+    self._file = open(self.path, 'a' if resume else 'w')
+
+  def Record(self, start, end):
+    """Records the items in [start, end) as completed."""
+    self._file.write('%d %d\n' % (start, end))
+    self._file.flush()
+
+    if self.fsync is True:
+      os.fsync(self._file.fileno())
+    elif self.fsync:
+      self._unsynced += 1
+      if self._unsynced >= self.fsync:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+  def Close(self, remove=False):
+    """Closes the journal.
+
+    Args:
+      remove - If True, the journal file is deleted, e.g. once every item has
+          been processed.
+    """
+    if self._file:
+      self._file.close()
+      self._file = None
+    if remove and os.path.exists(self.path):
+      os.remove(self.path)
+
+def Chunks(items, chunk_size, completed):
+  """Yields (start, end) index ranges of items not yet completed.
+
+  Args:
+    items - The full list of items.
+    chunk_size - Maximum number of items per chunk.
+    completed - Set of indexes to skip.
+  """
+  start = None
+  for i in xrange(len(items)):
+    if i in completed:
+      if start is not None:
+        yield start, i
+        start = None
+      continue
+    if start is None:
+      start = i
+    if i + 1 - start >= chunk_size:
+      yield start, i + 1
+      start = None
+  if start is not None:
+    yield start, len(items)
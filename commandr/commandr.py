@@ -36,6 +36,13 @@
 # of the argument is True, the command line parameter a flag with "no-" in
 # front of it.
 #
+# If a default value is a list, the argument may be given multiple times, and
+# the values are collected into a list. The type of the elements is taken from
+# the first element of the default (e.g. [0] for ints), or can be declared with
+# @command(element_types={'arg': int}); otherwise they are strings. Lists of
+# ints and floats, including their defaults, are passed to the function as
+# compact array.array objects.
+#
 # If there are extra command line arguments not specified as switches, those
 # values will be applied to each function argument in order, skipping any
 # function arguments with boolean defaults. To keep the interface cleaner,
@@ -122,18 +129,201 @@
 # main:
 #   If set, Commandr will use the supplied value as the command name to run
 #   if no command name is supplied.  It will override any previous values.
+#
+# checkpoint_dir:
+#   Directory where checkpoint journals of resumable commands are kept.
+#   Default is ~/.commandr/checkpoints.
+#
+# lock_dir:
+#   Directory where the lock files of commands with max_concurrent are kept.
+#   Default is ~/.commandr/locks.
+#
+# profile_dir:
+#   Directory the signal profiler writes collapsed stacks to. Default is the
+#   system temporary directory.
+#
+# A command with a list-valued argument can be made resumable by naming that
+# argument in the decorator:
+#
+#   @command('backfill', checkpoint='days', chunk_size=10)
+#   def Backfill(days=[]):
+#     ...
+#
+# The command is then called once per chunk of up to chunk_size elements (or
+# once with an empty list), and each completed chunk is recorded in a journal.
+# If the command fails, running it again with the same arguments and --resume
+# skips the completed elements.
+# --resume is not added for commands with an argument of the same name.
+#
+# Bash Tab-completion of argument values can be enabled by declaring value
+# providers for arguments:
+#
+#   @command('load', completions={'shard': ListShards,
+#                                 'mode': ['fast', 'safe']})
+#   def Load(shard, mode='fast'):
+#     ...
+#
+# See completion.py for the supported kinds of providers and how their values
+# are cached.
+#
+# The number of concurrent runs of a command on a host can be limited with file
+# locks:
+#
+#   @command('rebuild', max_concurrent=1)
+#   def Rebuild():
+#     ...
+#
+# A run that finds all lock slots held waits for one to be released, for at
+# most --lock-timeout seconds if given. With --lock-skip it exits immediately
+# instead. A run that does not get a slot exits with LOCK_SKIPPED_EXIT_CODE.
+# Neither option is added for commands with an argument of the same name.
+#
+# Commands can declare make-style dependencies:
+#
+#   @command('extract', outputs=['raw.csv'])
+#   def Extract(): ...
+#
+#   @command('report', requires=['extract'], inputs=['report.tmpl'],
+#            outputs=['report.html'])
+#   def Report(): ...
+#
+# Running 'report' first runs 'extract' (with its default arguments), running
+# up to -j N independent prerequisites at once. A command whose outputs are all
+# newer than its inputs, and the outputs of the commands it requires, is
+# skipped as up to date. --dry-run prints the plan instead of running it.
+# Neither -j nor --dry-run is added for commands with an argument of the same
+# name. Prerequisites are run with their own lock and checkpoint options, while
+# the command holds its own lock.
+#
+# Every command also accepts these options, which are consumed by commandr:
+#
+# --commandr-rusage=text|json:
+#   Print the resources used by the command (CPU time, peak RSS, page faults,
+#   context switches and block I/O) to stderr when it finishes.
+#
+# --commandr-max-memory=MB, --commandr-max-cpu=SECONDS, --commandr-max-files=N:
+#   Limit the address space, CPU time or number of open files of the process
+#   with setrlimit(). A command exceeding a limit fails with
+#   CommandrResourceLimitError.
+#
+# --commandr-trace=PATH:
+#   Write a timeline of the run to PATH in the Chrome Trace Event Format,
+#   covering the script import, command registration, parser generation,
+#   argument parsing and binding, the command itself and printing its result.
+#   Commands can add their own spans with commandr.span() (see tracing.py).
+#
+# --watch=PATH (repeatable), --watch-debounce=SECONDS:
+#   After running the command, watch the paths for changes and run it again,
+#   in the same process, once changes stop for the debounce window. A command
+#   declared with @command(watch_changes='arg') receives the changed paths in
+#   that argument. Not added for commands with arguments of the same names.
+#   --commandr-rusage reports each run separately, and --commandr-max-cpu
+#   cannot be combined with --watch.
+#
+# --commandr-profiler:
+#   Install signal handlers for diagnosing a running command: SIGUSR1 prints
+#   the stacks of all threads, and SIGUSR2 starts and stops a sampling profiler
+#   writing collapsed stacks to profile_dir (see profiler.py). Also enabled by
+#   setting the COMMANDR_PROFILER environment variable.
 
+import array
 from collections import namedtuple
+import errno
+import hashlib
 import inspect
 import itertools
-from optparse import OptionParser, SUPPRESS_HELP
+from optparse import OptionGroup, OptionParser, SUPPRESS_HELP
+import os
+import signal
 import sys
+import tempfile
+import time
+import traceback
+
+from checkpoint import CheckpointJournal, Chunks
+import completion
+import deps
+from locks import LockSlots
+from profiler import SignalProfiler
+import rusage
+import tracing
+
+# Exit status of a run that did not get a lock slot of its command.
+LOCK_SKIPPED_EXIT_CODE = 75
+
+# array.array type codes of the list element types stored as arrays.
+_ARRAY_TYPECODES = {int: 'l', long: 'l', float: 'd'}
+
+class _ArgQueue(object):
+  """The remaining command line arguments, supporting the operations optparse
+  applies to the front of its argument list in constant time. The arguments
+  are kept in reverse order, so that the front is the end of a list.
+  """
+
+  def __init__(self, args):
+    self._reversed = args[::-1]
+
+  def __len__(self):
+    return len(self._reversed)
+
+  def __getitem__(self, index):
+    if index == 0:
+      return self._reversed[-1]
+    return self.Remaining()[index]
+
+  def __delitem__(self, index):
+    if index == 0:
+      del self._reversed[-1]
+    else:
+      remaining = self.Remaining()
+      del remaining[index]
+      self._reversed = remaining[::-1]
+
+  def pop(self, index):
+    if index == 0:
+      return self._reversed.pop()
+    remaining = self.Remaining()
+    value = remaining.pop(index)
+    self._reversed = remaining[::-1]
+    return value
+
+  def insert(self, index, value):
+    if index == 0:
+      self._reversed.append(value)
+    else:
+      remaining = self.Remaining()
+      remaining.insert(index, value)
+      self._reversed = remaining[::-1]
+
+  def Remaining(self):
+    """Returns the remaining arguments, in order."""
+    return self._reversed[::-1]
+
+class _OptionParser(OptionParser):
+  """OptionParser that parses the command line in linear time. OptionParser
+  removes every argument from the front of a list, which takes quadratic time
+  for long lists of values.
+  """
+
+  def _process_args(self, largs, rargs, values):
+    queue = _ArgQueue(rargs)
+    try:
+      return OptionParser._process_args(self, largs, queue, values)
+    finally:
+      rargs[:] = queue.Remaining()
 
 class CommandInfo(
   namedtuple('BaseCommandInfo',
-             ['name', 'callable', 'category', 'ignore_self'])):
+             ['name', 'callable', 'category', 'ignore_self', 'checkpoint',
+              'chunk_size', 'checkpoint_fsync', 'completions',
+              'max_concurrent', 'lock_scope', 'element_types', 'requires',
+              'outputs', 'inputs', 'watch_changes'])):
   """Class to contain information about a spepcific supported command."""
-  def __new__(cls, name=None, callable=None, category=None, ignore_self=None):
+  def __new__(cls, name=None, callable=None, category=None, ignore_self=None,
+              checkpoint=None, chunk_size=1, checkpoint_fsync=True,
+              completions=None, max_concurrent=None, lock_scope='command',
+              element_types=None, requires=None, outputs=None, inputs=None,
+              watch_changes=None):
     """Creates a new CommandInfo allowing for default values.
 
     Args:
@@ -142,11 +332,28 @@ class CommandInfo(
       category - Category classification of the command.
       ignore_self - Whether the arg list should ignore the first value if it is
                     self.
+      checkpoint - Name of the list argument to process resumably, if any.
+      chunk_size - Number of elements of the checkpoint argument per call.
+      checkpoint_fsync - fsync policy of the checkpoint journal (see
+                         CheckpointJournal).
+      completions - Dict of argument name to value provider for Tab-completion.
+      max_concurrent - Maximum number of concurrent runs, or None for no limit.
+      lock_scope - Which runs count towards max_concurrent (see command).
+      element_types - Dict of list argument name to the type of its elements.
+      requires - Names of the commands to run before this one.
+      outputs - Paths (or glob patterns) of the files the command produces.
+      inputs - Paths (or glob patterns) of the files the command reads.
+      watch_changes - Name of the argument receiving the paths changed since
+                      the previous run in --watch mode.
     Returns:
       info - A CommandInfo.
     """
     return super(CommandInfo, cls).__new__(cls, name, callable, category,
-                                           ignore_self)
+                                           ignore_self, checkpoint, chunk_size,
+                                           checkpoint_fsync, completions,
+                                           max_concurrent, lock_scope,
+                                           element_types, requires, outputs,
+                                           inputs, watch_changes)
 
 class Commandr(object):
   """Class for managing commandr context."""
@@ -158,6 +365,9 @@ class Commandr(object):
     self.ignore_self = False
     self.main_docs = True
     self.main = None
+    self.checkpoint_dir = os.path.expanduser('~/.commandr/checkpoints')
+    self.lock_dir = os.path.expanduser('~/.commandr/locks')
+    self.profile_dir = tempfile.gettempdir()
 
     # Internal flag indicating whether to expect the command name as the first
     # command line argument.
@@ -172,10 +382,23 @@ class Commandr(object):
     #   [(name, callable, category)]
     self._command_list = []
 
+    # Destinations of the options commandr adds for its own use, which are
+    # removed before the command function is called.
+    self._runtime_dests = set()
+
+    # Names of the locks held by this process (see _AcquireLock).
+    self._held_locks = set()
+
+    # SignalProfiler, once installed.
+    self._profiler = None
+
     self.command('help', ignore_self=True)(self._HelpExitNoCommand)
 
   def command(self, command_name=None, category=None, main=False,
-              ignore_self=None):
+              ignore_self=None, checkpoint=None, chunk_size=1,
+              checkpoint_fsync=True, completions=None, max_concurrent=None,
+              lock_scope='command', element_types=None, requires=None,
+              outputs=None, inputs=None, watch_changes=None):
     """Decorator that marks a function as a 'command' which can be invoked with
     arguments from the command line. e.g.:
 
@@ -196,12 +419,49 @@ class Commandr(object):
         main.
       ignore_self - If True or False, it will apply the ignore_self option for
         this command, while others use the global default.
+      checkpoint - Name of a list argument (one with a list default) to process
+        resumably. The command is called once per chunk of the list, and
+        completed chunks are journaled so that --resume can skip them.
+      chunk_size - Number of list elements passed to each call of a
+        checkpointed command.
+      checkpoint_fsync - True to fsync the journal after every chunk, False to
+        never fsync, or an int N to fsync every N chunks.
+      completions - Dict of argument name to the provider of its values for
+        Bash Tab-completion. A provider is a list of choices, a callable
+        returning the choices, a 'module:function' string naming such a
+        callable, or a CompletionProvider to set how long values are cached.
+      max_concurrent - If set, at most this many runs of the command hold its
+        lock at once, enforced with file locks. Other runs wait or are skipped.
+      lock_scope - Which runs share the lock of max_concurrent. 'command' (the
+        default) for all runs of the command, 'arguments' for runs of the
+        command with the same arguments, or any other string to name a lock
+        shared with other commands using the same name.
+      element_types - Dict of list argument name to the type (or conversion
+        function) of its elements. By default the type of the first element of
+        the argument's default is used, or str if the default is empty.
+      requires - Names of commands to run, with their default arguments, before
+        this one. Independent prerequisites run in parallel with -j N.
+      outputs - Paths (or glob patterns) of the files the command produces. If
+        they all exist and are newer than the inputs, the command is skipped.
+      inputs - Paths (or glob patterns) of the files the command reads, in
+        addition to the outputs of the commands it requires.
+      watch_changes - Name of an argument that, when the command is re-run in
+        --watch mode, receives the sorted list of paths that changed. The
+        first run gets the argument's value from the command line.
     Returns:
       decorator/function to register the command.
     """
     def command_decorator(cmd_fn, cmd_fn_name=None):
       info = self.AddCommand(cmd_fn, cmd_fn_name or command_name, category,
-                             ignore_self)
+                             ignore_self, checkpoint=checkpoint,
+                             chunk_size=chunk_size,
+                             checkpoint_fsync=checkpoint_fsync,
+                             completions=completions,
+                             max_concurrent=max_concurrent,
+                             lock_scope=lock_scope,
+                             element_types=element_types,
+                             requires=requires, outputs=outputs,
+                             inputs=inputs, watch_changes=watch_changes)
       if main:
         if not self.main:
           self.main = info.name
@@ -217,7 +477,7 @@ class Commandr(object):
 
     return command_decorator
 
-  def AddCommand(self, cmd_fn, cmd_fn_name, category, ignore_self):
+  def AddCommand(self, cmd_fn, cmd_fn_name, category, ignore_self, **kwargs):
     """Adds a command to the commandr list.
 
     Args:
@@ -225,14 +485,44 @@ class Commandr(object):
       cmd_fn_name - The name of the command being added or the func_name.
       category - The category of the command.
       ignore_self - Whether to ignore self in the arg list.
+      kwargs - Remaining CommandInfo fields.
     Returns:
       info - The CommandInfo created.
     """
+    if kwargs.get('chunk_size', 1) < 1:
+      raise CommandrError('chunk_size must be at least 1')
+    if kwargs.get('max_concurrent') is not None and kwargs['max_concurrent'] < 1:
+      raise CommandrError('max_concurrent must be at least 1')
+
     final_name = (cmd_fn_name if cmd_fn_name is not None
                   else cmd_fn.func_name)
-    info = CommandInfo(final_name, cmd_fn, category, ignore_self)
-    self._all_commands[info.name] = info
-    self._command_list.append(info)
+
+    if kwargs.get('requires'):
+      def _RequiresOf(name):
+        if name == final_name:
+          return kwargs['requires']
+        info = self._all_commands.get(name)
+        return info and info.requires
+      cycle = deps.FindCycle(final_name, _RequiresOf)
+      if cycle:
+        raise CommandrDependencyError(
+            'Dependency cycle: %s' % ' -> '.join(cycle))
+
+    with tracing.span('AddCommand', command=final_name):
+      info = CommandInfo(final_name, cmd_fn, category, ignore_self, **kwargs)
+      if info.checkpoint:
+        defaults_dict = self._GetDefaults(self._GetArgSpec(info)[1])
+        if not isinstance(defaults_dict.get(info.checkpoint), list):
+          raise CommandrError(
+              "Checkpoint argument '%s' of command '%s' must have a list "
+              "default" % (info.checkpoint, info.name))
+      if (info.watch_changes
+          and info.watch_changes not in self._GetArgSpec(info)[1].args):
+        raise CommandrError(
+            "watch_changes argument '%s' of command '%s' does not exist" % (
+                info.watch_changes, info.name))
+      self._all_commands[info.name] = info
+      self._command_list.append(info)
     return info
 
   def SetOptions(self,
@@ -240,7 +530,10 @@ class Commandr(object):
       show_all_help_variants=None,
       ignore_self=None,
       main_docs=None,
-      main=None):
+      main=None,
+      checkpoint_dir=None,
+      lock_dir=None,
+      profile_dir=None):
     """Set commandr options. Any argument not set to None will be applied
     (otherwise it will retain its current value).
 
@@ -258,6 +551,9 @@ class Commandr(object):
           command is specified.  Default is True.
       main - If set, it will use the supplied value as the command name to run
           if no command name is supplied.  It will override any previous values.
+      checkpoint_dir - Directory where checkpoint journals are kept.
+      lock_dir - Directory where the lock files of commands are kept.
+      profile_dir - Directory the signal profiler writes collapsed stacks to.
     """
     # Anything added here should also be added to the RunFunction interface.
     if hyphenate is not None:
@@ -270,6 +566,12 @@ class Commandr(object):
       self.main_docs = main_docs
     if main is not None:
       self.main = main
+    if checkpoint_dir is not None:
+      self.checkpoint_dir = checkpoint_dir
+    if lock_dir is not None:
+      self.lock_dir = lock_dir
+    if profile_dir is not None:
+      self.profile_dir = profile_dir
 
   def Run(self, *args, **kwargs):
     """Main function to take command line arguments, and parse them into a
@@ -278,16 +580,21 @@ class Commandr(object):
     Args:
      All args are passed to SetOptions.  See SetOptions for detials.
     """
+    tracing.EndImport()
     self.SetOptions(*args, **kwargs)
 
     # Pull the command name from the first command line argument.
     if len(sys.argv) < 2 or sys.argv[1].startswith('-'):
-      if self.main is not None:
-        sys.argv.insert(1, self.main)
-        cmd_name = self.main
-      elif (len(sys.argv) in [2, 3]
+      if (len(sys.argv) in [2, 3]
           and sys.argv[1] == '--list_command_completions'):
         self._CompletionAllCommands(sys.argv[2] if len(sys.argv) > 2 else '')
+      elif (len(sys.argv) in [4, 5]
+          and sys.argv[1] == '--list_value_completions'):
+        self._CompletionValues(sys.argv[2], sys.argv[3],
+                               sys.argv[4] if len(sys.argv) > 4 else '')
+      elif self.main is not None:
+        sys.argv.insert(1, self.main)
+        cmd_name = self.main
       else:
         cmd_name = None
     else:
@@ -314,7 +621,10 @@ class Commandr(object):
       show_all_help_variants=None,
       ignore_self=None,
       main_doc=None,
-      main=None):
+      main=None,
+      checkpoint_dir=None,
+      lock_dir=None,
+      profile_dir=None):
     """Method to explicitly execute a given function against the command line
     arguments. If this method is called directly, the command name will not be
     expected in the arguments.
@@ -332,19 +642,35 @@ class Commandr(object):
           command is specified.  Default is True.
       main - If set, it will use the supplied value as the command name to run
           if no command name is supplied.  It will override any previous values.
+      checkpoint_dir - If not None, set the checkpoint_dir option to this value
+          (see SetOptions for details).
+      lock_dir - If not None, set the lock_dir option to this value (see
+          SetOptions for details).
+      profile_dir - If not None, set the profile_dir option to this value (see
+          SetOptions for details).
     """
+    tracing.EndImport()
+
     info = self._all_commands.get(cmd_name)
     if not info:
       info = self.AddCommand(cmd_fn, cmd_name, None, ignore_self)
 
     self.SetOptions(hyphenate, show_all_help_variants, ignore_self, main_doc,
-                    main)
+                    main, checkpoint_dir, lock_dir, profile_dir)
 
-    argspec, defaults_dict = self._BuildOptParse(info)
+    with tracing.span('_BuildOptParse', command=info.name):
+      argspec, defaults_dict = self._BuildOptParse(info)
 
-    (options, args) = self.parser.parse_args()
+    with tracing.span('parse_args'):
+      (options, args) = self.parser.parse_args()
 
+    bind_start = time.time()
     options_dict = vars(options)
+    runtime = dict((dest, options_dict.pop(dest))
+                   for dest in self._runtime_dests if dest in options_dict)
+
+    if runtime['commandr_profiler'] or os.environ.get('COMMANDR_PROFILER'):
+      self._InstallProfiler()
 
     # If help, print our message, else remove it so it doesn't confuse the
     # execution
@@ -403,10 +729,30 @@ class Commandr(object):
             if options_dict[key] is None:
               value = [value]
             else:
-              value = options_dict[key] + [value]
+              options_dict[key].append(value)
+              value = options_dict[key]
         # Update arg
         options_dict[key] = value
 
+    # Convert the values of list arguments to their element type in one pass.
+    for key, values in options_dict.iteritems():
+      if not isinstance(defaults_dict.get(key), list):
+        continue
+      element_type = self._ListElementType(info, key, defaults_dict[key])
+      if values is None:
+        # Pass defaults as arrays too, so that the function always receives
+        # the same type.
+        if element_type in _ARRAY_TYPECODES:
+          options_dict[key] = self._ConvertList(defaults_dict[key],
+                                                element_type)
+      else:
+        try:
+          options_dict[key] = self._ConvertList(values, element_type)
+        except ValueError as e:
+          self._HelpExitCommand(
+              "Invalid value for %s: %s" % (key, e),
+              info.name, info.callable, options_dict, argspec.args)
+
     for key, value in options_dict.iteritems():
       if value is None:
         if key not in defaults_dict:
@@ -415,15 +761,409 @@ class Commandr(object):
             info.name, info.callable, options_dict, argspec.args)
         elif defaults_dict[key] is not None:
           options_dict[key] = defaults_dict[key]
+    tracing.Record('bind arguments', bind_start, time.time())
+
+    if runtime.get('commandr_dry_run'):
+      self._PrintPlan(info, runtime.get('commandr_jobs', 1))
+      return
+
+    if (runtime.get('commandr_watch')
+        and runtime['commandr_max_cpu'] is not None):
+      # RLIMIT_CPU counts the CPU time of the whole process, not of each run.
+      self._HelpExitCommand(
+          "--commandr-max-cpu cannot be used with --watch",
+          info.name, info.callable, options_dict, argspec.args)
 
     self.current_command = info
+    limits = self._SetResourceLimits(runtime)
+    try:
+      if runtime.get('commandr_watch'):
+        self._Watch(info, options_dict, runtime)
+      else:
+        self._Execute(info, options_dict, runtime)
+    except MemoryError:
+      if 'RLIMIT_AS' not in limits:
+        raise
+      raise CommandrResourceLimitError(
+          "Command '%s' exceeded the memory limit of %d MB" % (
+              info.name, runtime['commandr_max_memory']))
+    except EnvironmentError as e:
+      if e.errno != errno.EMFILE or 'RLIMIT_NOFILE' not in limits:
+        raise
+      raise CommandrResourceLimitError(
+          "Command '%s' exceeded the open files limit of %d" % (
+              info.name, runtime['commandr_max_files']))
+
+  def _ListElementType(self, info, key, default):
+    """Returns the element type of a list argument.
+
+    Args:
+      info - CommandInfo of the command.
+      key - Name of the argument.
+      default - Default value of the argument.
+    Returns:
+      element_type - The type, or conversion function, of the elements.
+    """
+    if info.element_types and key in info.element_types:
+      return info.element_types[key]
+    if default and type(default[0]) in _ARRAY_TYPECODES:
+      return type(default[0])
+    return str
+
+  def _ConvertList(self, values, element_type):
+    """Converts the string values of a list argument to their element type.
+
+    Args:
+      values - List of strings.
+      element_type - Type, or conversion function, of the elements.
+    Returns:
+      converted - An array.array for ints and floats, otherwise a list.
+    """
+    if element_type is str:
+      return values
+
+    converted = map(element_type, values)
+    typecode = _ARRAY_TYPECODES.get(element_type)
+    if typecode:
+      try:
+        return array.array(typecode, converted)
+      except OverflowError:
+        # Too large for a C long; keep the Python ints.
+        pass
+    return converted
+
+  def _InstallProfiler(self):
+    """Installs the signal handlers of the profiler, if not already done."""
+    if self._profiler:
+      return
+    profiler = SignalProfiler(self.profile_dir)
     try:
-      result = info.callable(**options_dict)
+      profiler.Install()
+    except (NotImplementedError, ValueError) as e:
+      raise CommandrError('Cannot install the profiler: %s' % e)
+    self._profiler = profiler
+
+  def _SetResourceLimits(self, runtime):
+    """Applies the resource limits given by the runtime options.
+
+    Args:
+      runtime - Dictionary of the runtime options.
+    Returns:
+      limits - Set of the names of the limits applied.
+    """
+    limits = {}
+    if runtime['commandr_max_memory'] is not None:
+      limits['RLIMIT_AS'] = runtime['commandr_max_memory'] * 1024 * 1024
+    if runtime['commandr_max_cpu'] is not None:
+      limits['RLIMIT_CPU'] = runtime['commandr_max_cpu']
+    if runtime['commandr_max_files'] is not None:
+      limits['RLIMIT_NOFILE'] = runtime['commandr_max_files']
+
+    for name, value in limits.iteritems():
+      try:
+        rusage.SetLimit(name, value)
+      except (NotImplementedError, ValueError) as e:
+        raise CommandrError(str(e))
+
+    if 'RLIMIT_CPU' in limits:
+      seconds = runtime['commandr_max_cpu']
+      def _CpuLimitHandler(signum, frame):
+        # SIGXCPU is sent every second past the soft limit; only raise once.
+        signal.signal(signal.SIGXCPU, signal.SIG_IGN)
+        raise CommandrResourceLimitError(
+            "Command '%s' exceeded the CPU time limit of %d seconds" % (
+                self.current_command.name, seconds))
+      signal.signal(signal.SIGXCPU, _CpuLimitHandler)
+
+    return set(limits)
+
+  def _Execute(self, info, options_dict, runtime):
+    """Runs the prerequisites of a command, then the command itself, and
+    reports the resources used if requested.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Arguments to call the command function with.
+      runtime - Dictionary of the runtime options.
+    """
+    before = rusage.Snapshot() if runtime['commandr_rusage'] else None
+    try:
+      # The lock is held while the prerequisites run, so that runs skipped
+      # or kept waiting by it do not repeat their work.
+      lock = self._AcquireLock(info, options_dict, runtime)
+      try:
+        if info.requires:
+          self._RunPrerequisites(info, runtime)
+        self._RunCommand(info, options_dict, runtime)
+      finally:
+        self._ReleaseLock(lock)
+    finally:
+      if before:
+        usage = rusage.Delta(before, rusage.Snapshot())
+        print >>sys.stderr, rusage.Format(info.name, usage,
+                                          runtime['commandr_rusage'])
+
+  def _RunCommand(self, info, options_dict, runtime):
+    """Runs a command, but not its prerequisites, unless it is up to date.
+    The caller holds the command's lock.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Arguments to call the command function with.
+      runtime - Dictionary of the runtime options.
+    """
+    if info.outputs and not self._NeedsRun(info):
+      print >>sys.stderr, "commandr: '%s' is up to date" % info.name
+    elif info.checkpoint:
+      self._CallCheckpointed(info, options_dict,
+                             runtime.get('commandr_resume', False))
+    else:
+      self._CallCommand(info, options_dict)
+
+  def _Watch(self, info, options_dict, runtime):
+    """Runs a command, then runs it again whenever the watched paths change,
+    until interrupted. Errors raised by a run, including usage errors and
+    sys.exit(), are printed, and do not stop the watch.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Arguments to call the command function with.
+      runtime - Dictionary of the runtime options.
+    """
+    # Imported here, since it is only needed with --watch.
+    import watch
+
+    paths = runtime['commandr_watch']
+    watcher = watch.Watcher(paths)
+    try:
+      run_options = options_dict
+      while True:
+        try:
+          self._Execute(info, run_options, runtime)
+        except SystemExit as e:
+          print >>sys.stderr, "commandr: '%s' exited with status %s" % (
+              info.name, e.code)
+        except Exception:
+          traceback.print_exc()
+
+        print >>sys.stderr, "commandr: watching %d path(s) for changes" % (
+            len(paths))
+        changed = watch.WaitForChanges(watcher,
+                                       runtime['commandr_watch_debounce'])
+        print >>sys.stderr, "commandr: %d path(s) changed, running '%s'" % (
+            len(changed), info.name)
+
+        if info.watch_changes:
+          run_options = dict(options_dict)
+          run_options[info.watch_changes] = sorted(changed)
+    finally:
+      watcher.Close()
+
+  def _RequiresOf(self, name):
+    """Returns the names of the commands a command requires."""
+    if name not in self._all_commands:
+      raise CommandrDependencyError("Unknown required command '%s'" % name)
+    return self._all_commands[name].requires or []
+
+  def _NeedsRun(self, info):
+    """Returns whether a command is not up to date with its inputs."""
+    if not info.outputs:
+      return True
+    inputs = list(info.inputs or [])
+    for name in info.requires or []:
+      inputs.extend(self._all_commands[name].outputs or [])
+    return not deps.IsUpToDate(info.outputs, inputs)
+
+  def _RunPrerequisites(self, info, runtime):
+    """Runs the commands required by a command, in dependency order.
+
+    Args:
+      info - CommandInfo of the command.
+      runtime - Dictionary of the runtime options. Up to 'commandr_jobs'
+          prerequisites run at once.
+    """
+    order = deps.Order(info.name, self._RequiresOf)[:-1]
+    for name in order:
+      cmd_fn_root, argspec = self._GetArgSpec(self._all_commands[name])
+      if inspect.ismethod(cmd_fn_root):
+        argspec.args.pop(0)
+      if len(argspec.args) > len(argspec.defaults or ()):
+        raise CommandrDependencyError(
+            "Required command '%s' has arguments without defaults" % name)
+
+    try:
+      deps.Schedule(order, self._RequiresOf,
+                    lambda name: self._RunPrerequisite(name, runtime),
+                    runtime.get('commandr_jobs', 1))
+    except deps.ScheduleError as e:
+      # Like the command itself, a run that does not get the lock of a
+      # prerequisite is skipped.
+      if all(status == LOCK_SKIPPED_EXIT_CODE for _, status in e.failed):
+        sys.exit(LOCK_SKIPPED_EXIT_CODE)
+      raise CommandrDependencyError(
+          "Prerequisites of '%s' failed: %s" % (info.name, e))
+
+  def _RunPrerequisite(self, name, runtime):
+    """Runs a required command with its default arguments, unless it is up to
+    date. Its lock and checkpoint options apply as if it was run directly.
+
+    Args:
+      name - Name of the command.
+      runtime - Dictionary of the runtime options.
+    """
+    info = self._all_commands[name]
+    argspec = self._GetArgSpec(info)[1]
+    defaults_dict = self._GetDefaults(argspec)
+
+    current_command = self.current_command
+    self.current_command = info
+    try:
+      lock = self._AcquireLock(info, defaults_dict, runtime)
+      try:
+        self._RunCommand(info, defaults_dict, runtime)
+      finally:
+        self._ReleaseLock(lock)
+    finally:
+      self.current_command = current_command
+
+  def _PrintPlan(self, info, jobs):
+    """Prints the commands that running a command would run or skip.
+
+    Args:
+      info - CommandInfo of the command.
+      jobs - Maximum number of prerequisites to run at once.
+    """
+    print "Plan for '%s' (-j %d):" % (info.name, jobs)
+    will_run = {}
+    for name in deps.Order(info.name, self._RequiresOf):
+      required = self._all_commands[name]
+      # A prerequisite that will run may update the outputs used as inputs.
+      will_run[name] = self._NeedsRun(required) or any(
+          will_run[r] and self._all_commands[r].outputs
+          for r in required.requires or [])
+      requires = (' (requires %s)' % ', '.join(required.requires)
+                  if required.requires else '')
+      print '  %s %s%s' % ('run' if will_run[name] else 'skip (up to date)',
+                           name, requires)
+
+  def _AcquireLock(self, info, options_dict, runtime):
+    """Acquires a lock slot of a command with max_concurrent, waiting or
+    exiting with LOCK_SKIPPED_EXIT_CODE as chosen by the runtime options.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Arguments the command will be called with.
+      runtime - Dictionary of the runtime options.
+    Returns:
+      lock - The held LockSlots, or None if the command has no limit or this
+          process already holds the lock, e.g. for a prerequisite sharing the
+          lock of the command that requires it.
+    """
+    if not info.max_concurrent:
+      return None
+
+    if info.lock_scope == 'command':
+      name = info.name
+    elif info.lock_scope == 'arguments':
+      name = '%s-%s' % (info.name, self._InvocationKey(info, options_dict))
+    else:
+      name = info.lock_scope
+    if name in self._held_locks:
+      return None
+
+    timeout = (0 if runtime.get('commandr_lock_skip')
+               else runtime.get('commandr_lock_timeout'))
+    lock = LockSlots(self.lock_dir, name, info.max_concurrent)
+    try:
+      with tracing.span('acquire lock', command=info.name):
+        acquired, waited, attempts = lock.Acquire(timeout)
+    except NotImplementedError as e:
+      raise CommandrError(str(e))
+
+    if not acquired:
+      print >>sys.stderr, (
+          "commandr: skipping '%s': all %d slot(s) of lock '%s' are held "
+          "(waited %.3fs)" % (info.name, info.max_concurrent, name, waited))
+      sys.exit(LOCK_SKIPPED_EXIT_CODE)
+    if attempts > 1:
+      print >>sys.stderr, (
+          "commandr: acquired slot %d/%d of lock '%s' after waiting %.3fs "
+          "(%d attempts)" % (lock.slot + 1, info.max_concurrent, name, waited,
+                             attempts))
+    self._held_locks.add(name)
+    return lock
+
+  def _ReleaseLock(self, lock):
+    """Releases a lock returned by _AcquireLock, if any."""
+    if lock:
+      self._held_locks.discard(lock.name)
+      lock.Release()
+
+  def _InvocationKey(self, info, options_dict):
+    """Returns a stable key identifying an invocation of a command, used to
+    name its checkpoint journal and per-arguments lock.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Dictionary of the arguments the command is invoked with.
+    Returns:
+      key - Hex digest string.
+    """
+    args = repr(sorted(options_dict.items()))
+    return hashlib.sha1('%s\0%s' % (info.name, args)).hexdigest()
+
+  def _CallCommand(self, info, options_dict):
+    """Calls the command function and prints its result, if any.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Arguments to call the command function with.
+    """
+    result = None
+    try:
+      with tracing.span('command', command=info.name):
+        result = info.callable(**options_dict)
     except CommandrUsageError as e:
       self.Usage(str(e) or None)
 
     if result:
-      print result
+      with tracing.span('print result'):
+        print result
+
+  def _CallCheckpointed(self, info, options_dict, resume):
+    """Calls a checkpointed command once per chunk of its checkpoint argument,
+    journaling each completed chunk. If the argument is empty, the command is
+    called once with it, without a journal.
+
+    Args:
+      info - CommandInfo of the command.
+      options_dict - Arguments to call the command function with.
+      resume - If True, skip the chunks completed by a previous run.
+    """
+    key = info.checkpoint
+    items = options_dict[key]
+    if not items:
+      self._CallCommand(info, options_dict)
+      return
+
+    journal = CheckpointJournal(
+        os.path.join(self.checkpoint_dir,
+                     '%s-%s' % (info.name,
+                                self._InvocationKey(info, options_dict))),
+        fsync=info.checkpoint_fsync)
+    completed = journal.Completed() if resume else set()
+
+    journal.Open(resume)
+    try:
+      for start, end in Chunks(items, info.chunk_size, completed):
+        chunk_options = dict(options_dict)
+        chunk_options[key] = items[start:end]
+        self._CallCommand(info, chunk_options)
+        journal.Record(start, end)
+    except:
+      journal.Close()
+      raise
+    journal.Close(remove=True)
 
   def _BuildOptParse(self, info):
     """Sets the current command parser to reflect the provided command.
@@ -442,22 +1182,84 @@ class Commandr(object):
         'Options without default values MUST be specified\n\n' + \
         'Use: %prog help [command]\n  to see other commands available.'
 
-    self.parser = OptionParser(usage=usage, add_help_option=False)
+    self.parser = _OptionParser(usage=usage, add_help_option=False)
 
     self._AddOption(['-h', '--help'], dest='help', action='store_true',
                      default=False)
 
+    # Reflect the command function's arguments.
+    argspec = self._GetArgSpec(info)[1]
+
+    self._runtime_dests = set()
+    self._runtime_group = OptionGroup(self.parser, 'Commandr Options')
+    self.parser.add_option_group(self._runtime_group)
+    self._AddRuntimeOption(
+        ['--commandr-rusage'], dest='commandr_rusage', type='choice',
+        choices=['text', 'json'], metavar='FORMAT', default=None,
+        help='Print the resources used by the command to stderr, as text or '
+        'json')
+    self._AddRuntimeOption(
+        ['--commandr-max-memory'], dest='commandr_max_memory', type='int',
+        metavar='MB', default=None,
+        help='Limit the address space of the process')
+    self._AddRuntimeOption(
+        ['--commandr-max-cpu'], dest='commandr_max_cpu', type='int',
+        metavar='SECONDS', default=None,
+        help='Limit the CPU time of the process')
+    self._AddRuntimeOption(
+        ['--commandr-max-files'], dest='commandr_max_files', type='int',
+        metavar='N', default=None,
+        help='Limit the number of open files of the process')
+    self._AddRuntimeOption(
+        [tracing.TRACE_FLAG], dest='commandr_trace', metavar='PATH',
+        default=None,
+        help='Write a Chrome trace of the run to PATH')
+    self._AddRuntimeOption(
+        ['--commandr-profiler'], dest='commandr_profiler', action='store_true',
+        default=False,
+        help='Print thread stacks on SIGUSR1, and toggle a sampling profiler '
+        'on SIGUSR2')
+    if info.checkpoint and 'resume' not in argspec.args:
+      self._AddRuntimeOption(
+          ['--resume'], dest='commandr_resume', action='store_true',
+          default=False,
+          help='Skip the elements of %s completed by a previous run' %
+          info.checkpoint)
+    if info.max_concurrent and 'lock_timeout' not in argspec.args:
+      self._AddRuntimeOption(
+          ['--lock-timeout'], dest='commandr_lock_timeout', type='float',
+          metavar='SECONDS', default=None,
+          help='Seconds to wait for a lock slot [default: wait forever]')
+    if info.max_concurrent and 'lock_skip' not in argspec.args:
+      self._AddRuntimeOption(
+          ['--lock-skip'], dest='commandr_lock_skip', action='store_true',
+          default=False,
+          help='Exit with status %d instead of waiting for a lock slot' %
+          LOCK_SKIPPED_EXIT_CODE)
+    if 'watch' not in argspec.args and 'watch_debounce' not in argspec.args:
+      self._AddRuntimeOption(
+          ['--watch'], dest='commandr_watch', action='append', metavar='PATH',
+          default=None,
+          help='After running, re-run whenever PATH changes (repeatable)')
+      self._AddRuntimeOption(
+          ['--watch-debounce'], dest='commandr_watch_debounce', type='float',
+          metavar='SECONDS', default=0.2,
+          help='Wait for changes to stop for SECONDS before re-running '
+          '[default: %default]')
+    if (info.requires or info.outputs) and 'dry_run' not in argspec.args:
+      self._AddRuntimeOption(
+          ['--dry-run'], dest='commandr_dry_run', action='store_true',
+          default=False,
+          help='Print the commands that would run, without running them')
+    if info.requires and 'jobs' not in argspec.args:
+      self._AddRuntimeOption(
+          ['-j', '--jobs'], dest='commandr_jobs', type='int', metavar='N',
+          default=1, help='Run up to N prerequisites at once [default: 1]')
+
     # Parse the command function's arguments into the OptionsParser.
     letters = set(['h']) # -h is for help
-
-    # Check if the command function is wrapped with other decorators, and if so,
-    # find the original function signature.
-    cmd_fn_root = info.callable
-    while hasattr(cmd_fn_root, '__wrapped__'):
-      cmd_fn_root = getattr(cmd_fn_root, '__wrapped__')
-
-    # Reflect the command function's arguments.
-    argspec = inspect.getargspec(cmd_fn_root)
+    if info.requires and 'jobs' not in argspec.args:
+      letters.add('j') # -j is for jobs
 
     # Populates defaults iff there is a default
     defaults_dict = {}
@@ -518,6 +1320,33 @@ class Commandr(object):
 
     return argspec, defaults_dict
 
+  def _GetDefaults(self, argspec):
+    """Returns a dictionary of the arguments with a default value in an
+    ArgSpec to their default.
+    """
+    if not argspec.defaults:
+      return {}
+    return dict(zip(argspec.args[-len(argspec.defaults):], argspec.defaults))
+
+  def _GetArgSpec(self, info):
+    """Reflects the arguments of a command function.
+
+    Args:
+      info - CommandInfo of the command.
+    Returns:
+      cmd_fn_root - The original command function, if it is wrapped with other
+          decorators.
+      argspec - ArgSpec object returned from inspect.getargspec() on
+          cmd_fn_root.
+    """
+    # Check if the command function is wrapped with other decorators, and if so,
+    # find the original function signature.
+    cmd_fn_root = info.callable
+    while hasattr(cmd_fn_root, '__wrapped__'):
+      cmd_fn_root = getattr(cmd_fn_root, '__wrapped__')
+
+    return cmd_fn_root, inspect.getargspec(cmd_fn_root)
+
   def _AddOption(self, args, **kwargs):
     """Adds an option to the parser.
 
@@ -557,6 +1386,19 @@ class Commandr(object):
         del kwargs_hidden['default']
       self.parser.add_option(*args_hidden, **kwargs_hidden)
 
+  def _AddRuntimeOption(self, args, **kwargs):
+    """Adds an option that is consumed by commandr rather than passed to the
+    command function.
+
+    Args:
+      args - List of arguments to add. These are added to the 'Commandr
+             Options' group of the help, and are not hyphenated.
+      kwargs - Remaining arguments to be passed to add_option. 'dest' is
+               required.
+    """
+    self._runtime_group.add_option(*args, **kwargs)
+    self._runtime_dests.add(kwargs['dest'])
+
   def _CompletionAllCommands(self, prefix):
     """Given a command name prefix, print a ' ' delimited list of all possible
     commands that match, and exit with success. Useful for bash tab completion.
@@ -564,12 +1406,84 @@ class Commandr(object):
     Args:
       prefix - Command name prefix.
     """
+    self._WriteCompletionSpec()
+
     print ' '.join([
         c.name for c in self._command_list
         if c.name.startswith(prefix)])
 
     sys.exit(0)
 
+  def _CompletionValues(self, cmd_name, option, prefix):
+    """Given a command name, one of its options and a value prefix, print a
+    ' ' delimited list of the values of the option's provider that match, and
+    exit with success. Useful for bash tab completion.
+
+    Args:
+      cmd_name - Command name.
+      option - Option string, e.g. '--shard'.
+      prefix - Value prefix.
+    """
+    self._WriteCompletionSpec()
+
+    info = self._all_commands.get(cmd_name)
+    if info and info.completions:
+      self._BuildOptParse(info)
+      opt = self.parser.get_option(option)
+      provider = opt and info.completions.get(opt.dest)
+      if provider is not None:
+        spec = completion.ProviderSpec(provider, self._ScriptPath(),
+                                       '%s:%s' % (info.name, opt.dest))
+        if isinstance(provider, completion.CompletionProvider):
+          provider = provider.provider
+        if isinstance(provider, basestring):
+          load = lambda: completion.LoadProvider(provider)
+        else:
+          load = lambda: provider
+        values = completion.ProviderValues(spec, load)
+        print ' '.join(v for v in values if v.startswith(prefix))
+
+    sys.exit(0)
+
+  def _WriteCompletionSpec(self):
+    """Writes the completion spec used to complete argument values without
+    running the script (see completion.py). Failures are ignored, since
+    completion still works without the spec, just more slowly.
+    """
+    try:
+      self._TryWriteCompletionSpec()
+    except Exception:
+      pass
+
+  def _TryWriteCompletionSpec(self):
+    """Writes the completion spec, raising any error (see
+    _WriteCompletionSpec).
+    """
+    script = self._ScriptPath()
+    commands = {}
+    for info in self._command_list:
+      if not info.completions:
+        continue
+      self._BuildOptParse(info)
+      options = {}
+      for opt in self.parser.option_list:
+        if opt.dest in info.completions:
+          for opt_str in opt._short_opts + opt._long_opts:
+            options[opt_str] = opt.dest
+      commands[info.name] = {
+          'options': options,
+          'providers': dict(
+              (arg, completion.ProviderSpec(provider, script,
+                                            '%s:%s' % (info.name, arg)))
+              for arg, provider in info.completions.iteritems())}
+
+    if commands:
+      completion.WriteSpec(script, commands)
+
+  def _ScriptPath(self):
+    """Returns the real path of the running script."""
+    return os.path.realpath(sys.argv[0])
+
   def Usage(self, message=None):
     """Prints out a Usage message and exits."""
     if self.current_command:
@@ -654,7 +1568,7 @@ class Commandr(object):
       for arg in arglist:
         arg_start =  " --%s=" % arg
         arg_list = (arg_start.join(str(a) for a in options_dict[arg])
-                    if isinstance(options_dict[arg], list)
+                    if isinstance(options_dict[arg], (list, array.array))
                     else str(options_dict[arg]))
         print "%s%s" % (arg_start, arg_list)
       print ""
@@ -679,3 +1593,5 @@ class Commandr(object):
 class CommandrError(Exception): pass
 class CommandrUsageError(CommandrError): pass
 class CommandrDuplicateMainError(CommandrError): pass
+class CommandrResourceLimitError(CommandrError): pass
+class CommandrDependencyError(CommandrError): pass
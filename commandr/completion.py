@@ -0,0 +1,222 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# Bash Tab-completion of argument values.
+#
+# Commands declare value providers for their arguments. Whenever a script
+# answers a completion request, it writes a completion spec describing its
+# commands' options and providers to the cache directory. Later requests are
+# answered by running this module:
+#
+#   $ python -m commandr.completion <script> <command> <option> <prefix>
+#
+# which reads the spec and imports only the provider's module, instead of the
+# whole script. Provider results are cached on disk for the provider's TTL. If
+# the spec is missing or older than the script, or the provider lives in the
+# script itself, this exits with a non-zero status and the caller falls back
+# to asking the script:
+#
+#   $ <script> --list_value_completions <command> <option> <prefix>
+#
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+import sys
+import time
+
+# Explicitly relative, since this module is also run with -m.
+from .fs_util import MakeDirs
+
+DEFAULT_TTL = 60
+
+class CompletionProvider(
+  namedtuple('BaseCompletionProvider', ['provider', 'ttl'])):
+  """Class to attach a cache TTL to a completion value provider."""
+  def __new__(cls, provider, ttl=DEFAULT_TTL):
+    """Creates a new CompletionProvider.
+
+    Args:
+      provider - A list of choices, a callable returning the choices, or a
+          'module:function' string naming such a callable.
+      ttl - Seconds the provider's values are cached for.
+    Returns:
+      provider - A CompletionProvider.
+    """
+    return super(CompletionProvider, cls).__new__(cls, provider, ttl)
+
+def ProviderSpec(provider, script, name):
+  """Converts a provider to its JSON-serializable form for the spec.
+
+  Args:
+    provider - A CompletionProvider, or anything accepted as its provider.
+    script - Absolute path of the script declaring the provider.
+    name - Name of the command and argument the provider is declared for, used
+        to key the cached values of providers without a 'module:function'
+        path.
+  Returns:
+    spec - A dict with either 'choices', or 'path', 'key' and 'ttl'. 'path' is
+        None if the provider can only be loaded by running the script.
+  """
+  ttl = DEFAULT_TTL
+  if isinstance(provider, CompletionProvider):
+    provider, ttl = provider
+
+  if isinstance(provider, (list, tuple, set, frozenset)):
+    return {'choices': [str(c) for c in provider]}
+
+  if isinstance(provider, basestring):
+    path = provider
+  else:
+    # Callables that cannot be imported by name, such as lambdas, partials
+    # and callable instances, can only be loaded by running the script.
+    module = getattr(provider, '__module__', None)
+    attr = getattr(provider, '__name__', None)
+    if not (module and attr
+            and getattr(sys.modules.get(module), attr, None) is provider):
+      return {'path': None, 'key': '%s:%s' % (script, name), 'ttl': ttl}
+    path = '%s:%s' % (module, attr)
+
+  if path.startswith('__main__:'):
+    return {'path': None, 'key': '%s:%s' % (script, path), 'ttl': ttl}
+  return {'path': path, 'key': path, 'ttl': ttl}
+
+def CacheDir():
+  """Returns the directory completion specs and values are cached in."""
+  return (os.environ.get('COMMANDR_CACHE_DIR')
+          or os.path.expanduser('~/.commandr/cache'))
+
+def _CachePath(kind, key):
+  """Returns the cache file path of a key."""
+  if isinstance(key, unicode):
+    key = key.encode('utf-8')
+  return os.path.join(CacheDir(),
+                      '%s-%s.json' % (kind, hashlib.sha1(key).hexdigest()))
+
+def _WriteJson(path, data):
+  """Atomically writes data as JSON to path."""
+  MakeDirs(os.path.dirname(path))
+  tmp_path = '%s.%d' % (path, os.getpid())
+  with open(tmp_path, 'w') as f:
+    json.dump(data, f)
+  os.rename(tmp_path, path)
+
+def _ReadJson(path):
+  """Returns the JSON data in path, or None if it is missing or corrupt."""
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return None
+
+def WriteSpec(script, commands):
+  """Writes the completion spec of a script.
+
+  Args:
+    script - Absolute path of the script.
+    commands - Dict of command name to a dict with 'options', mapping option
+        strings to argument names, and 'providers', mapping argument names to
+        provider specs (see ProviderSpec).
+  """
+  _WriteJson(_CachePath('spec', script), {
+      'mtime': os.path.getmtime(script),
+      'sys_path': [os.path.dirname(script)],
+      'commands': commands})
+
+def ReadSpec(script):
+  """Returns the completion spec of a script, or None if there isn't an up to
+  date one.
+  """
+  spec = _ReadJson(_CachePath('spec', script))
+  if spec and spec['mtime'] == os.path.getmtime(script):
+    return spec
+  return None
+
+def ProviderValues(spec, load):
+  """Returns the values of a provider, from the cache if they are fresh.
+
+  Args:
+    spec - Provider spec (see ProviderSpec).
+    load - Function returning the provider callable.
+  Returns:
+    values - List of value strings.
+  """
+  if 'choices' in spec:
+    return spec['choices']
+
+  path = _CachePath('values', spec['key'])
+  cached = _ReadJson(path)
+  if cached and time.time() - cached['time'] < spec['ttl']:
+    return cached['values']
+
+  values = [str(v) for v in load()()]
+  try:
+    _WriteJson(path, {'time': time.time(), 'values': values})
+  except (IOError, OSError):
+    pass
+  return values
+
+def LoadProvider(path):
+  """Imports and returns the callable named by a 'module:function' path."""
+  module_name, _, attr = path.partition(':')
+  __import__(module_name)
+  return getattr(sys.modules[module_name], attr)
+
+def _FindScript(script):
+  """Resolves the script as typed on the command line to an absolute path."""
+  if os.path.sep not in script:
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+      candidate = os.path.join(directory, script)
+      if os.path.isfile(candidate):
+        return os.path.realpath(candidate)
+  return os.path.realpath(script)
+
+def main(argv):
+  """Prints the completions of an option value.
+
+  Args:
+    argv - [program, script, command, option, prefix].
+  Returns:
+    status - 0 if the request was answered, 1 if the script must be asked.
+  """
+  if len(argv) not in [4, 5]:
+    return 1
+  script, cmd_name, option = argv[1:4]
+  prefix = argv[4] if len(argv) > 4 else ''
+
+  script = _FindScript(script)
+  if not os.path.isfile(script):
+    return 1
+  spec = ReadSpec(script)
+  if not spec:
+    return 1
+
+  cmd_spec = spec['commands'].get(cmd_name)
+  arg = cmd_spec and cmd_spec['options'].get(option)
+  provider = arg and cmd_spec['providers'].get(arg)
+  if not provider:
+    return 0
+  if 'choices' not in provider and provider['path'] is None:
+    return 1
+
+  sys.path[:0] = spec['sys_path']
+  values = ProviderValues(provider, lambda: LoadProvider(provider['path']))
+  print ' '.join(v for v in values if v.startswith(prefix))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
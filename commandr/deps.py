@@ -0,0 +1,197 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# Make-style dependency resolution and scheduling of commands. Commands are
+# identified by name, and the graph is given as a function returning the names
+# a command requires.
+#
+
+import glob
+import os
+import sys
+import time
+import traceback
+
+def FindCycle(name, requires_of):
+  """Finds a dependency cycle through a command.
+
+  Args:
+    name - Name of the command to start from.
+    requires_of - Function returning the list of names a command requires, or
+        None for commands that are not (yet) known.
+  Returns:
+    cycle - List of names forming the cycle, starting and ending with name, or
+        None if there is no cycle through name.
+  """
+  path = [name]
+  visited = set()
+
+  def _Visit(current):
+    for required in requires_of(current) or []:
+      if required == name:
+        return path + [name]
+      if required in visited:
+        continue
+      visited.add(required)
+      path.append(required)
+      cycle = _Visit(required)
+      if cycle:
+        return cycle
+      path.pop()
+    return None
+
+  return _Visit(name)
+
+def Order(name, requires_of):
+  """Returns the commands needed to run a command, prerequisites first.
+
+  Args:
+    name - Name of the command.
+    requires_of - Function returning the list of names a command requires.
+        Raises KeyError for unknown commands.
+  Returns:
+    order - List of names, ending with name.
+  """
+  order = []
+  seen = set()
+
+  def _Visit(current):
+    seen.add(current)
+    for required in requires_of(current):
+      if required not in seen:
+        _Visit(required)
+    order.append(current)
+
+  _Visit(name)
+  return order
+
+def _ExpandPaths(patterns):
+  """Returns the paths matching a list of paths or glob patterns."""
+  paths = []
+  for pattern in patterns:
+    matches = glob.glob(pattern)
+    paths.extend(matches if matches else [pattern])
+  return paths
+
+def IsUpToDate(outputs, inputs):
+  """Returns whether all outputs exist and are newer than all inputs.
+
+  Args:
+    outputs - List of output paths or glob patterns. Must not be empty.
+    inputs - List of input paths or glob patterns.
+  """
+  try:
+    oldest_output = min(os.path.getmtime(p) for p in _ExpandPaths(outputs))
+  except OSError:
+    return False
+  for path in _ExpandPaths(inputs):
+    if not os.path.exists(path) or os.path.getmtime(path) > oldest_output:
+      return False
+  return True
+
+class ScheduleError(Exception):
+  """Raised when commands run by the scheduler fail.
+
+  Attributes:
+    failed - List of (name, exit status) of the commands that failed.
+  """
+
+  def __init__(self, failed):
+    Exception.__init__(self, ', '.join(
+        "'%s' failed with exit status %s" % f for f in failed))
+    self.failed = failed
+
+def _ExitStatus(run, name):
+  """Runs a command, and returns its exit status as if it had run as a
+  process: the code of a SystemExit it raises, 1 (after printing the
+  traceback) if it raises any other exception, and 0 otherwise.
+  """
+  try:
+    run(name)
+  except SystemExit as e:
+    if e.code is None:
+      return 0
+    if isinstance(e.code, (int, long)):
+      return e.code
+    print >>sys.stderr, e.code
+    return 1
+  except Exception:
+    traceback.print_exc()
+    return 1
+  return 0
+
+def _RunInChild(run, name):
+  """Process target running a command, exiting with its exit status."""
+  sys.exit(_ExitStatus(run, name))
+
+def Schedule(order, requires_of, run, jobs=1, poll_interval=0.01):
+  """Runs commands in dependency order, running up to jobs commands with
+  satisfied dependencies at once.
+
+  With jobs == 1 commands run in this process, in the given order. Otherwise
+  each command runs in a forked process. Either way, a command fails if it
+  raises an exception or exits with a non-zero status, and a failure stops new
+  commands from being started.
+
+  Args:
+    order - List of command names, prerequisites first (see Order).
+    requires_of - Function returning the list of names a command requires.
+    run - Function running a command by name.
+    jobs - Maximum number of commands to run at once.
+    poll_interval - Seconds between checks for finished processes.
+  Raises:
+    ScheduleError - If a command failed.
+  """
+  if jobs <= 1:
+    for name in order:
+      status = _ExitStatus(run, name)
+      if status:
+        raise ScheduleError([(name, status)])
+    return
+
+  # Imported here, since it is slow to import and only needed for jobs > 1.
+  import multiprocessing
+
+  pending = list(order)
+  done = set()
+  running = {}
+  failed = []
+  while pending or running:
+    if not failed:
+      for name in list(pending):
+        if len(running) >= jobs:
+          break
+        if all(r in done for r in requires_of(name)):
+          pending.remove(name)
+          process = multiprocessing.Process(target=_RunInChild,
+                                            args=(run, name))
+          process.start()
+          running[name] = process
+    elif not running:
+      break
+
+    time.sleep(poll_interval)
+    for name, process in running.items():
+      if not process.is_alive():
+        process.join()
+        del running[name]
+        if process.exitcode == 0:
+          done.add(name)
+        else:
+          failed.append((name, process.exitcode))
+
+  if failed:
+    raise ScheduleError(failed)
@@ -0,0 +1,31 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# File system utilities for the state commandr keeps on disk.
+#
+
+import errno
+import os
+
+def MakeDirs(directory):
+  """Creates a directory and its parents, unless it already exists. Safe to
+  call from several processes at once, e.g. the first runs of a cron job.
+  """
+  try:
+    os.makedirs(directory)
+  except OSError as e:
+    if e.errno != errno.EEXIST or not os.path.isdir(directory):
+      raise
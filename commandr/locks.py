@@ -0,0 +1,120 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# File lock slots used to limit the number of concurrent runs of a command.
+# A lock with N slots is a set of N files, each of which can be flock()ed by a
+# single process. The kernel releases the locks when the process exits, so a
+# crashed run never leaves a slot held.
+#
+
+import hashlib
+import os
+import re
+import time
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+from fs_util import MakeDirs
+
+class LockSlots(object):
+  """A named lock that can be held by up to a fixed number of processes."""
+
+  def __init__(self, directory, name, slots=1):
+    """Initializes a LockSlots.
+
+    Args:
+      directory - Directory the lock files are kept in.
+      name - Name of the lock.
+      slots - Number of processes that can hold the lock at once.
+    """
+    self.directory = directory
+    self.name = name
+    self.slots = slots
+    self.slot = None
+    self._file = None
+
+  def _FileName(self):
+    """Returns the lock name made safe for use as a file name. Names that
+    need changing get a hash suffix, so that they cannot collide.
+    """
+    safe = re.sub(r'[^\w.-]', '_', self.name)
+    if safe != self.name:
+      safe = '%s-%s' % (safe, hashlib.sha1(self.name).hexdigest()[:12])
+    return safe
+
+  def _TryAcquire(self):
+    """Tries to lock a free slot without blocking.
+
+    Returns:
+      acquired - True if a slot was locked.
+    """
+    for slot in xrange(self.slots):
+      path = os.path.join(self.directory,
+                          '%s.%d.lock' % (self._FileName(), slot))
+      f = open(path, 'a')
+      try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except IOError:
+        f.close()
+        continue
+      self.slot = slot
+      self._file = f
+      return True
+    return False
+
+  def Acquire(self, timeout=None, poll_interval=0.05, max_poll_interval=1.0):
+    """Locks a free slot, waiting for one if they are all held.
+
+    Args:
+      timeout - Seconds to wait for a free slot. None waits forever, and 0
+          does not wait at all.
+      poll_interval - Initial seconds between attempts. Doubled after every
+          attempt, up to max_poll_interval.
+      max_poll_interval - Maximum seconds between attempts.
+    Returns:
+      (acquired, waited, attempts) - Whether a slot was locked, the seconds
+          spent waiting, and the number of attempts made.
+    """
+    if fcntl is None:
+      raise NotImplementedError('File locks are not supported on this platform')
+    MakeDirs(self.directory)
+
+    start = time.time()
+    attempts = 0
+    while True:
+      attempts += 1
+      if self._TryAcquire():
+        return True, time.time() - start, attempts
+
+      waited = time.time() - start
+      if timeout is not None and waited >= timeout:
+        return False, waited, attempts
+      delay = poll_interval
+      if timeout is not None:
+        delay = min(delay, timeout - waited)
+      time.sleep(delay)
+      poll_interval = min(poll_interval * 2, max_poll_interval)
+
+  def Release(self):
+    """Releases the held slot, if any."""
+    if self._file:
+      fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+      self._file.close()
+      self._file = None
+      self.slot = None
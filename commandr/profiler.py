@@ -0,0 +1,273 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# Signal-triggered diagnostics for long-running commands:
+#
+#   kill -USR1 <pid>  prints the stacks of all threads to stderr.
+#   kill -USR2 <pid>  starts a statistical profiler; a second SIGUSR2 stops it
+#                     and writes the samples in the collapsed-stack format used
+#                     by flamegraph.pl and speedscope.
+#
+# Python runs signal handlers in the main thread between bytecodes, so they
+# cannot run while the main thread is blocked or deadlocked. On Linux, the
+# signals are instead blocked in the command's threads, and received with
+# sigwait() by a daemon thread, which handles them whatever the main thread is
+# doing. Since the signals are blocked, they do not interrupt the command's
+# system calls either. Processes started by the command inherit the blocked
+# signals. Elsewhere, the signals are handled in the main thread.
+#
+# The profiler samples the stacks of all threads from another daemon thread,
+# every interval of wall time, so threads blocked in calls are sampled too.
+# Errors while handling a signal are reported on stderr, and are never raised
+# into the command.
+#
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+# pthread_sigmask() 'how' value blocking signals, from <signal.h> on Linux.
+_SIG_BLOCK = 0
+
+def _LoadLibc():
+  """Returns libc if it supports waiting for signals from a thread, otherwise
+  None.
+  """
+  if not sys.platform.startswith('linux'):
+    return None
+  # Imported here, since it is only needed once the profiler is installed.
+  import ctypes
+  try:
+    # The symbols of the running process, which include libc's, so that
+    # libc does not have to be looked up.
+    libc = ctypes.CDLL(None, use_errno=True)
+  except OSError:
+    return None
+  for name in ['sigemptyset', 'sigaddset', 'pthread_sigmask', 'sigwait']:
+    if not hasattr(libc, name):
+      return None
+  return libc
+
+class SignalProfiler(object):
+  """Dumps thread stacks on SIGUSR1, and toggles a sampling profiler on
+  SIGUSR2.
+  """
+
+  def __init__(self, output_dir, interval=0.01):
+    """Initializes a SignalProfiler.
+
+    Args:
+      output_dir - Directory the collapsed stacks are written to.
+      interval - Seconds of wall time between samples.
+    """
+    self.output_dir = output_dir
+    self.interval = interval
+    self._counts = None
+    self._started = None
+    self._sessions = 0
+    self._sampler = None
+    self._stop_sampling = None
+    # Serializes starting and stopping the profiler, which is done from the
+    # signal handling thread and at exit.
+    self._lock = threading.Lock()
+    # Idents of the profiler's own threads, which are not dumped or sampled.
+    self._own_threads = set()
+
+  def Install(self):
+    """Installs the signal handlers. Must be called from the main thread,
+    before the command starts any threads.
+
+    Raises:
+      NotImplementedError - If the platform lacks the signals used.
+      ValueError - If output_dir is not a writable directory.
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+      raise NotImplementedError(
+          'The signal profiler is not supported on this platform')
+    if (not os.path.isdir(self.output_dir)
+        or not os.access(self.output_dir, os.W_OK | os.X_OK)):
+      raise ValueError('%s is not a writable directory' % self.output_dir)
+
+    # Handlers for platforms without sigwait(), and for signals delivered to
+    # threads started before the signals were blocked.
+    for signum in [signal.SIGUSR1, signal.SIGUSR2]:
+      signal.signal(signum, self._HandleInMainThread)
+      signal.siginterrupt(signum, False)
+
+    libc = _LoadLibc()
+    if libc:
+      import ctypes
+      # sigset_t is 128 bytes with glibc.
+      sigset = ctypes.create_string_buffer(128)
+      libc.sigemptyset(sigset)
+      libc.sigaddset(sigset, signal.SIGUSR1)
+      libc.sigaddset(sigset, signal.SIGUSR2)
+      # Threads inherit the signal mask, so the signals are blocked in the
+      # threads the command starts, and in the signal handling thread.
+      if libc.pthread_sigmask(_SIG_BLOCK, sigset, None) == 0:
+        self._StartThread('commandr-signals', self._WaitForSignals,
+                          libc, sigset)
+    atexit.register(self._StopAtExit)
+
+  def _StartThread(self, name, target, *args):
+    """Starts one of the profiler's own daemon threads."""
+    def _Run():
+      self._own_threads.add(threading.current_thread().ident)
+      target(*args)
+    thread = threading.Thread(target=_Run, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+  def _WaitForSignals(self, libc, sigset):
+    """Body of the signal handling thread."""
+    import ctypes
+    signum = ctypes.c_int()
+    while True:
+      if libc.sigwait(sigset, ctypes.byref(signum)) != 0:
+        print >>sys.stderr, 'commandr: profiler stopped waiting for signals'
+        return
+      self._Handle(signum.value)
+
+  def _HandleInMainThread(self, signum, frame):
+    """Signal handler, run in the main thread."""
+    self._Handle(signum, frame)
+
+  def _Handle(self, signum, frame=None):
+    """Handles a signal, reporting any error on stderr.
+
+    Args:
+      signum - SIGUSR1 or SIGUSR2.
+      frame - The frame interrupted by the signal, if handled in the main
+          thread.
+    """
+    try:
+      if signum == signal.SIGUSR1:
+        self._DumpStacks(frame)
+      else:
+        self._Toggle()
+    except Exception:
+      print >>sys.stderr, 'commandr: profiler failed: %s' % (
+          traceback.format_exc().rstrip('\n'))
+
+  def _Frames(self, frame=None):
+    """Returns (name, ident, current frame) of the command's threads.
+
+    Args:
+      frame - The frame interrupted by the signal, used for the current thread
+          instead of the signal handler's own frame.
+    """
+    names = dict((t.ident, t.name) for t in threading.enumerate())
+    frames = sys._current_frames()
+    if frame is not None:
+      frames[threading.current_thread().ident] = frame
+    return [(names.get(ident, str(ident)), ident, f)
+            for ident, f in frames.items()
+            if f is not None and ident not in self._own_threads]
+
+  def _DumpStacks(self, frame=None):
+    """Prints the stacks of all threads."""
+    threads = self._Frames(frame)
+    lines = ['commandr: stacks of %d thread(s) of process %d:' % (
+        len(threads), os.getpid())]
+    for name, ident, f in sorted(threads):
+      lines.append('')
+      lines.append('Thread %s (%d):' % (name, ident))
+      lines.extend(l.rstrip('\n') for l in traceback.format_stack(f))
+    print >>sys.stderr, '\n'.join(lines)
+
+  def _Toggle(self):
+    """Starts or stops the sampling profiler."""
+    with self._lock:
+      if self._counts is None:
+        self.Start()
+      else:
+        self.Stop()
+
+  def Start(self):
+    """Starts sampling."""
+    self._counts = {}
+    self._started = time.time()
+    self._stop_sampling = threading.Event()
+    self._sampler = self._StartThread('commandr-sampler', self._SampleLoop,
+                                      self._counts, self._stop_sampling)
+    print >>sys.stderr, (
+        'commandr: profiler started, send SIGUSR2 to %d again to stop' %
+        os.getpid())
+
+  def _SampleLoop(self, counts, stop):
+    """Body of the sampling thread. If sampling fails, it stops, and the
+    samples taken so far are written by Stop.
+    """
+    try:
+      while not stop.is_set():
+        self._Sample(counts)
+        time.sleep(self.interval)
+    except Exception:
+      print >>sys.stderr, 'commandr: profiler failed to sample: %s' % (
+          traceback.format_exc().rstrip('\n'))
+
+  def _Sample(self, counts):
+    """Records the stacks of all threads in counts."""
+    for name, _, f in self._Frames():
+      stack = []
+      while f is not None:
+        code = f.f_code
+        stack.append('%s (%s:%d)' % (code.co_name,
+                                     os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        f = f.f_back
+      stack.append(name)
+      key = ';'.join(reversed(stack))
+      counts[key] = counts.get(key, 0) + 1
+
+  def Stop(self):
+    """Stops sampling and writes the collapsed stacks.
+
+    Returns:
+      path - Path of the written file.
+    """
+    self._stop_sampling.set()
+    self._sampler.join()
+    self._own_threads.discard(self._sampler.ident)
+    counts, self._counts = self._counts, None
+
+    self._sessions += 1
+    path = os.path.join(self.output_dir, 'commandr-%d-%d.folded' % (
+        os.getpid(), self._sessions))
+    with open(path, 'w') as f:
+      for stack, count in sorted(counts.iteritems()):
+        f.write('%s %d\n' % (stack, count))
+
+    print >>sys.stderr, (
+        'commandr: profiler stopped after %.1fs, %d samples written to %s' % (
+            time.time() - self._started, sum(counts.itervalues()), path))
+    return path
+
+  def _StopAtExit(self):
+    """Writes the samples if the process exits while sampling."""
+    with self._lock:
+      if self._counts is None:
+        return
+      try:
+        self.Stop()
+      except Exception:
+        print >>sys.stderr, 'commandr: profiler failed: %s' % (
+            traceback.format_exc().rstrip('\n'))
@@ -0,0 +1,115 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# Resource accounting and limits for command runs, using getrusage() and
+# setrlimit().
+#
+
+import json
+import time
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# getrusage() fields reported, in order, with their report names. Every field
+# but ru_maxrss (the peak resident set size, in KB) is reported as the change
+# over the run, summed over the process and the child processes it waited for,
+# such as prerequisites run with -j N.
+USAGE_FIELDS = [
+    ('ru_utime', 'user_cpu_seconds'),
+    ('ru_stime', 'system_cpu_seconds'),
+    ('ru_maxrss', 'max_rss_kb'),
+    ('ru_minflt', 'minor_page_faults'),
+    ('ru_majflt', 'major_page_faults'),
+    ('ru_nvcsw', 'voluntary_context_switches'),
+    ('ru_nivcsw', 'involuntary_context_switches'),
+    ('ru_inblock', 'block_input_ops'),
+    ('ru_oublock', 'block_output_ops'),
+]
+
+def Snapshot():
+  """Returns the current (wall time, rusage of the process, rusage of its
+  terminated and waited for child processes).
+  """
+  if resource is None:
+    raise NotImplementedError(
+        'Resource accounting is not supported on this platform')
+  return (time.time(), resource.getrusage(resource.RUSAGE_SELF),
+          resource.getrusage(resource.RUSAGE_CHILDREN))
+
+def Delta(before, after):
+  """Returns the resource usage between two snapshots.
+
+  Args:
+    before - Snapshot taken before the run.
+    after - Snapshot taken after the run.
+  Returns:
+    usage - Dict of report name to value, including 'wall_seconds'.
+  """
+  usage = {'wall_seconds': after[0] - before[0]}
+  for field, name in USAGE_FIELDS:
+    if field == 'ru_maxrss':
+      # The largest of the process and of any one child.
+      usage[name] = max(after[1].ru_maxrss, after[2].ru_maxrss)
+    else:
+      usage[name] = sum(getattr(after[i], field) - getattr(before[i], field)
+                        for i in [1, 2])
+  return usage
+
+def Format(cmd_name, usage, output_format):
+  """Formats a resource usage report.
+
+  Args:
+    cmd_name - Name of the command that ran.
+    usage - Dict returned by Delta.
+    output_format - 'text' or 'json'.
+  Returns:
+    report - The report string.
+  """
+  if output_format == 'json':
+    report = dict(usage, command=cmd_name)
+    return json.dumps(report, sort_keys=True)
+
+  lines = ["commandr: resource usage of '%s':" % cmd_name,
+           '  %-30s %.3f' % ('wall_seconds', usage['wall_seconds'])]
+  for _, name in USAGE_FIELDS:
+    value = usage[name]
+    if isinstance(value, float):
+      lines.append('  %-30s %.3f' % (name, value))
+    else:
+      lines.append('  %-30s %d' % (name, value))
+  return '\n'.join(lines)
+
+def SetLimit(name, value):
+  """Lowers the soft limit of a resource, keeping the hard limit.
+
+  Args:
+    name - Name of the resource.limit constant, e.g. 'RLIMIT_AS'.
+    value - New soft limit.
+  Raises:
+    ValueError - If value exceeds the hard limit.
+  """
+  if resource is None:
+    raise NotImplementedError('Resource limits are not supported on this '
+                              'platform')
+  limit = getattr(resource, name)
+  _, hard = resource.getrlimit(limit)
+  if hard != resource.RLIM_INFINITY and value > hard:
+    raise ValueError('%s of %d exceeds the hard limit of %d' % (
+        name, value, hard))
+  resource.setrlimit(limit, (value, hard))
@@ -0,0 +1,138 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# Timeline tracing of commandr runs, written in the Chrome Trace Event Format
+# (viewable in chrome://tracing or Perfetto).
+#
+# Tracing is enabled by passing --commandr-trace=<path> on the command line.
+# Since the script's imports and command registration happen before the
+# command line is parsed, the flag is detected in sys.argv when this module is
+# imported. When tracing is disabled, span() returns a shared no-op context
+# manager.
+#
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_FLAG = '--commandr-trace'
+
+def _TracePath(argv):
+  """Returns the trace output path given in argv, or None."""
+  for i, arg in enumerate(argv):
+    if arg.startswith(TRACE_FLAG + '='):
+      return arg[len(TRACE_FLAG) + 1:]
+    if arg == TRACE_FLAG and i + 1 < len(argv):
+      return argv[i + 1]
+  return None
+
+_trace_path = _TracePath(sys.argv)
+_import_start = time.time()
+_import_done = False
+
+# Recorded trace events, or None if tracing is disabled.
+_events = [] if _trace_path else None
+_thread_names = {}
+
+class _Span(object):
+  """Context manager recording a complete ('X') trace event."""
+
+  def __init__(self, name, args):
+    self.name = name
+    self.args = args
+    self.start = None
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc_info):
+    Record(self.name, self.start, time.time(), self.args)
+
+class _NoopSpan(object):
+  """Context manager used when tracing is disabled."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name, **args):
+  """Returns a context manager recording a span of the trace, e.g.:
+
+    with commandr.span('load'):
+      ...
+
+  Spans may be nested, and are recorded with the ID of the current thread.
+
+  Args:
+    name - Name of the span.
+    args - Values to attach to the span.
+  """
+  if _events is None:
+    return _NOOP_SPAN
+  return _Span(name, args)
+
+def Record(name, start, end, args=None):
+  """Records a span of the trace.
+
+  Args:
+    name - Name of the span.
+    start - Start time, in seconds since the epoch.
+    end - End time, in seconds since the epoch.
+    args - Optional dict of values to attach to the span.
+  """
+  if _events is None:
+    return
+  thread = threading.current_thread()
+  _thread_names[thread.ident] = thread.name
+  _events.append({
+      'name': name,
+      'ph': 'X',
+      'ts': start * 1e6,
+      'dur': (end - start) * 1e6,
+      'pid': os.getpid(),
+      'tid': thread.ident,
+      'args': args or {}})
+
+def EndImport():
+  """Records the span from the import of commandr to the start of the run, the
+  first time it is called.
+  """
+  global _import_done
+  if not _import_done:
+    _import_done = True
+    Record('import', _import_start, time.time())
+
+def Write():
+  """Writes the recorded events to the trace path."""
+  if _events is None:
+    return
+  events = list(_events)
+  for tid, thread_name in _thread_names.items():
+    events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                   'tid': tid, 'args': {'name': thread_name}})
+  with open(_trace_path, 'w') as f:
+    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+if _events is not None:
+  atexit.register(Write)
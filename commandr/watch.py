@@ -0,0 +1,264 @@
+# Copyright 2013 TellApart, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# =============================================================================
+#
+# File change watching for --watch. On Linux, inotify is used through ctypes.
+# Elsewhere, or if inotify cannot be set up, the watched paths are polled with
+# os.stat().
+#
+# Files are watched through their parent directory, so that editors which save
+# by replacing the file are still seen. Directories are watched recursively.
+#
+# libc is only loaded when a watcher is created, since finding it runs
+# ldconfig, which would slow down every run of every script.
+#
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# inotify event masks, from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+               IN_MOVED_TO | IN_CREATE | IN_DELETE)
+_EVENT_HEADER = struct.Struct('iIII')
+
+def _LoadLibc():
+  """Returns libc if it supports inotify, otherwise None."""
+  name = ctypes.util.find_library('c')
+  if not name:
+    return None
+  try:
+    libc = ctypes.CDLL(name, use_errno=True)
+  except OSError:
+    return None
+  if not hasattr(libc, 'inotify_init'):
+    return None
+  return libc
+
+# (libc or None,) once loaded.
+_libc = None
+
+def _Libc():
+  """Returns libc if it supports inotify, otherwise None, loading it on the
+  first call.
+  """
+  global _libc
+  if _libc is None:
+    _libc = (_LoadLibc(),)
+  return _libc[0]
+
+class InotifyWatcher(object):
+  """Watches paths for changes with inotify."""
+
+  def __init__(self, paths):
+    """Initializes an InotifyWatcher.
+
+    Args:
+      paths - List of file and directory paths to watch.
+    Raises:
+      OSError - If inotify cannot be set up.
+    """
+    self.paths = [os.path.abspath(p) for p in paths]
+    self._libc = _Libc()
+    self._fd = self._libc.inotify_init()
+    if self._fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+    # Mapping of watch descriptor to (directory, set of watched file names, or
+    # None if every entry of the directory is watched).
+    self._watches = {}
+    for path in self.paths:
+      if os.path.isdir(path):
+        self._AddTree(path)
+      else:
+        self._AddWatch(os.path.dirname(path), os.path.basename(path))
+
+  def _AddWatch(self, directory, name=None):
+    """Adds a watch on a directory, for one of its entries or all of them."""
+    wd = self._libc.inotify_add_watch(self._fd, directory, _WATCH_MASK)
+    if wd < 0:
+      raise OSError(ctypes.get_errno(),
+                    'inotify_add_watch failed for %s' % directory)
+    current = self._watches.get(wd, (directory, set()))[1]
+    if name is None or current is None:
+      self._watches[wd] = (directory, None)
+    else:
+      current.add(name)
+      self._watches[wd] = (directory, current)
+
+  def _AddTree(self, directory):
+    """Adds watches on a directory and all its subdirectories."""
+    for root, _, _ in os.walk(directory):
+      self._AddWatch(root)
+
+  def Wait(self, timeout=None):
+    """Waits for changes to the watched paths.
+
+    Args:
+      timeout - Seconds to wait for a change, or None to wait forever.
+    Returns:
+      changed - Set of changed paths, empty if the timeout expired first.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+      remaining = None if deadline is None else max(0, deadline - time.time())
+      try:
+        readable, _, _ = select.select([self._fd], [], [], remaining)
+      except select.error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      if not readable:
+        return set()
+
+      # Events for unwatched entries of a watched file's directory are
+      # dropped, so keep waiting until a watched path changes.
+      changed = self._ReadEvents()
+      if changed:
+        return changed
+
+  def _ReadEvents(self):
+    """Reads the pending inotify events.
+
+    Returns:
+      changed - Set of changed watched paths.
+    """
+    data = os.read(self._fd, 64 * 1024)
+    changed = set()
+    offset = 0
+    while offset < len(data):
+      wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+      offset += _EVENT_HEADER.size
+      name = data[offset:offset + length].rstrip('\0')
+      offset += length
+
+      if mask & IN_Q_OVERFLOW:
+        changed.update(self.paths)
+        continue
+      if wd not in self._watches:
+        continue
+      directory, names = self._watches[wd]
+      if names is not None and name not in names:
+        continue
+
+      path = os.path.join(directory, name) if name else directory
+      changed.add(path)
+      if (names is None and mask & IN_ISDIR
+          and mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path)):
+        self._AddTree(path)
+    return changed
+
+  def Close(self):
+    """Releases the inotify instance."""
+    os.close(self._fd)
+
+class PollingWatcher(object):
+  """Watches paths for changes by comparing os.stat() snapshots."""
+
+  def __init__(self, paths, poll_interval=0.5):
+    """Initializes a PollingWatcher.
+
+    Args:
+      paths - List of file and directory paths to watch.
+      poll_interval - Seconds between snapshots.
+    """
+    self.paths = [os.path.abspath(p) for p in paths]
+    self.poll_interval = poll_interval
+    self._snapshot = self._Snapshot()
+
+  def _Snapshot(self):
+    """Returns a mapping of every watched file to its (mtime, size)."""
+    snapshot = {}
+    for path in self.paths:
+      if os.path.isdir(path):
+        files = (os.path.join(root, name)
+                 for root, _, names in os.walk(path) for name in names)
+      else:
+        files = [path]
+      for f in files:
+        try:
+          st = os.stat(f)
+        except OSError:
+          continue
+        snapshot[f] = (st.st_mtime, st.st_size)
+    return snapshot
+
+  def Wait(self, timeout=None):
+    """Waits for changes to the watched paths.
+
+    Args:
+      timeout - Seconds to wait for a change, or None to wait forever.
+    Returns:
+      changed - Set of changed paths, empty if the timeout expired first.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+      snapshot = self._Snapshot()
+      changed = set(path for path in set(snapshot) | set(self._snapshot)
+                    if snapshot.get(path) != self._snapshot.get(path))
+      self._snapshot = snapshot
+      if changed:
+        return changed
+
+      remaining = None if deadline is None else deadline - time.time()
+      if remaining is not None and remaining <= 0:
+        return set()
+      time.sleep(self.poll_interval if remaining is None
+                 else min(self.poll_interval, remaining))
+
+  def Close(self):
+    """Nothing to release."""
+    pass
+
+def Watcher(paths):
+  """Returns an InotifyWatcher for paths if inotify is available, otherwise a
+  PollingWatcher.
+  """
+  if _Libc() is not None:
+    try:
+      return InotifyWatcher(paths)
+    except OSError:
+      pass
+  return PollingWatcher(paths)
+
+def WaitForChanges(watcher, debounce):
+  """Waits for changes, then for the changes to stop for a debounce window.
+
+  Args:
+    watcher - InotifyWatcher or PollingWatcher.
+    debounce - Seconds without changes that end a batch of changes.
+  Returns:
+    changed - Set of all paths changed in the batch.
+  """
+  changed = watcher.Wait()
+  while True:
+    more = watcher.Wait(debounce)
+    if not more:
+      return changed
+    changed |= more
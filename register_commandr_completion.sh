@@ -19,16 +19,34 @@
 # Bash Tab-completion registration for commandr scripts. This is used like:
 #  $ source register_commandr_completion.sh example.py
 #
+# Option values are completed by 'python -m commandr.completion'. Set
+# COMMANDR_PYTHON to use an interpreter other than 'python' for this.
+#
 
 function _CommandrCompletion() {
-  local cur
+  local cur prev
   cur=${COMP_WORDS[COMP_CWORD]}
+  prev=${COMP_WORDS[COMP_CWORD-1]}
+
+  # Bash splits '--option=value' into '--option', '=' and 'value'.
+  if [ "${cur}" == "=" ] ; then
+    cur=""
+  elif [ "${prev}" == "=" ] ; then
+    prev=${COMP_WORDS[COMP_CWORD-2]}
+  fi
 
   COMPREPLY=()
 
-  # Only do completion on the command name.
   if [ $1 == $3 ] ; then
+    # Complete the command name.
     COMPREPLY=($( $1 --list_command_completions "${cur}" ))
+  elif [[ ${COMP_CWORD} -gt 2 && "${prev}" == -* ]] ; then
+    # Complete an option value, without running the script when possible.
+    COMPREPLY=($(
+        ${COMMANDR_PYTHON:-python} -m commandr.completion \
+            "$1" "${COMP_WORDS[1]}" "${prev}" "${cur}" 2>/dev/null ||
+        $1 --list_value_completions \
+            "${COMP_WORDS[1]}" "${prev}" "${cur}" 2>/dev/null ))
   fi
 
   return 0